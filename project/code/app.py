@@ -2,7 +2,8 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import json  # Added for JSON export
-from scheduler import Scheduler 
+from collections import defaultdict
+from scheduler import Scheduler, from_minutes
 
 st.set_page_config(page_title="Exam Scheduler", layout="wide")
 
@@ -26,53 +27,83 @@ if "solver" not in st.session_state:
     st.session_state.solver = None
 if "final_schedule" not in st.session_state:
     st.session_state.final_schedule = None
+if "student_rows" not in st.session_state:
+    st.session_state.student_rows = None
+
+@st.cache_resource
+def get_loaded_scheduler():
+    """Parses the RDF data once and shares the loaded Scheduler across reruns."""
+    solver = Scheduler()
+    solver.load_data()
+    return solver
+
+@st.cache_data(hash_funcs={Scheduler: id})
+def compute_schedule(solver):
+    """Runs the backtracking search once per loaded Scheduler instance."""
+    return solver.schedule_backtrack({}, solver.ordered_classes())
 
 def get_master_df(schedule, solver):
     rows = []
-    for course_code, details in schedule.items():
-        start_dt = details['window'][0]
-        end_dt = details['window'][1]
-        
+    for course_code, (room, start, end) in schedule.items():
+        start_dt, end_dt = from_minutes(start, solver.time_zone), from_minutes(end, solver.time_zone)
         rows.append({
             "Course": course_code,
             "Start": start_dt, "End": end_dt,
             "Day": start_dt.strftime("%A, %b %d"),
             "SortDate": start_dt.date(),
-            "Room": str(details['room']),
-            "Label": f"{course_code} ({details['room']})",
+            "Room": solver.room_names[room],
+            "Label": f"{course_code} ({solver.room_names[room]})",
             "Students": list(solver.course_to_students.get(course_code, []))
         })
     return pd.DataFrame(rows).sort_values(by=["Start", "Room"])
 
+def build_student_rows(df):
+    """Maps each student to the positional rows of df_master they sit in."""
+    student_rows = defaultdict(list)
+    for i, students in enumerate(df["Students"]):
+        for student in students:
+            student_rows[student].append(i)
+    return student_rows
+
 # --- Helper Function for JSON Export ---
-def convert_schedule_to_json(schedule):
+def convert_schedule_to_json(schedule, solver):
     """Converts datetime objects to strings for JSON serialization."""
     export_data = {}
-    for course, details in schedule.items():
+    for course, (room, start, end) in schedule.items():
         export_data[course] = {
-            "room": details['room'],
-            "start": details['window'][0].isoformat(),
-            "end": details['window'][1].isoformat()
+            "room": solver.room_names[room],
+            "start": from_minutes(start, solver.time_zone).isoformat(),
+            "end": from_minutes(end, solver.time_zone).isoformat()
         }
     return json.dumps(export_data, indent=4)
 
 st.title("Exam Schedule")
 
 if st.button("Generate Schedule"):
-    solver = Scheduler()
-    solver.load_data()
-    all_classes = list(solver.classes.keys())
-    st.session_state.final_schedule = solver.schedule_backtrack({}, all_classes)
+    solver = get_loaded_scheduler()
+    unschedulable = solver.unschedulable_classes()
+    if unschedulable:
+        st.error(f"No room and availability window fits: {', '.join(unschedulable)}")
+        st.session_state.final_schedule = None
+    else:
+        st.session_state.final_schedule = compute_schedule(solver)
     st.session_state.solver = solver
+    st.session_state.student_rows = None
+
+if st.button("Reload Data"):
+    get_loaded_scheduler.clear()
+    compute_schedule.clear()
 
 if st.session_state.final_schedule:
     df_master = get_master_df(st.session_state.final_schedule, st.session_state.solver)
+    if st.session_state.student_rows is None:
+        st.session_state.student_rows = build_student_rows(df_master)
     
     # --- Sidebar Controls ---
     st.sidebar.header("Options")
     
     # JSON Download Button
-    json_string = convert_schedule_to_json(st.session_state.final_schedule)
+    json_string = convert_schedule_to_json(st.session_state.final_schedule, st.session_state.solver)
     st.sidebar.download_button(
         label="📥 Download Schedule (JSON)",
         data=json_string,
@@ -96,7 +127,7 @@ if st.session_state.final_schedule:
         y_val, facet = "Course", "Day"
     else:
         sel_student = st.sidebar.selectbox("Search Student Profile", sorted(list(st.session_state.solver.student_courses.keys())))
-        plot_df = df_master[df_master["Students"].apply(lambda x: sel_student in x)].copy()
+        plot_df = df_master.iloc[st.session_state.student_rows.get(sel_student, [])].copy()
         y_val, facet = "Course", "Day"
 
     # --- Plotting Logic ---
@@ -144,7 +175,7 @@ if st.session_state.final_schedule:
 
         if facet:
             fig.for_each_annotation(lambda a: a.update(
-                text=f"<b>{a.text.split('=')[-1]}</b>", 
+                text=f"<b>{a.text.rpartition('=')[2]}</b>", 
                 font=dict(size=20, color="white")
             ))
 
@@ -1,143 +1,577 @@
+import bisect
+import functools
 import json
-from datetime import timedelta
-from rdflib import Graph, Namespace, URIRef
-from rdflib.namespace import split_uri
+import math
+import os
+import pickle
+import re
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+EX_PREFIX = "http://example.org/"
+P_ENROLLED = EX_PREFIX + "enrolledIn"
+P_MIN_CAP = EX_PREFIX + "hasMinimumRoomCapacity"
+P_DURATION = EX_PREFIX + "examDuration"
+P_ROOM_CAP = EX_PREFIX + "roomCapacity"
+P_HAS_AVAIL = EX_PREFIX + "hasAvailability"
+P_FROM = EX_PREFIX + "availableFrom"
+P_UNTIL = EX_PREFIX + "availableUntil"
+
+Option = namedtuple("Option", "room start end")
+
+EPOCH = datetime(1970, 1, 1)
+GAP_MINUTES = 10
+
+CLASSES_TTL = "./data/classes.ttl"
+ROOMS_TTL = "./data/rooms.ttl"
+STUDENTS_TTL = "./data/students.ttl"
+CACHE_PATH = "./data/.scheduler_cache.pickle"
+
+ENROLLMENT_QUERY = "SELECT ?student ?course WHERE { ?student ex:enrolledIn ?course }"
+CLASS_QUERY = """
+SELECT ?class ?cap ?duration WHERE {
+    ?class ex:hasMinimumRoomCapacity ?cap ;
+           ex:examDuration ?duration .
+}"""
+ROOM_QUERY = """
+SELECT ?room ?cap ?slot WHERE {
+    ?room ex:roomCapacity ?cap .
+    OPTIONAL { ?room ex:hasAvailability ?slot }
+}"""
+TIME_SLOT_QUERY = """
+SELECT ?slot ?from ?until WHERE {
+    ?slot ex:availableFrom ?from ;
+          ex:availableUntil ?until .
+}"""
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+TURTLE_TOKEN = re.compile(r'''
+    (?P<space>\s+|\#[^\n]*)
+  | (?P<string>"(?:[^"\\\n]|\\.)*")(?:\^\^(?P<datatype>[^\s;,.]*:[^\s;,]*?)(?=[;,]|\.?(?:\s|$))|@[\w-]+)?
+  | <(?P<iri>[^>\s]*)>
+  | (?P<punct>[;,]|\.(?=\s|\#|$))
+  | (?P<name>[^\s;,"<>\#\[\]()]+?)(?=[;,]|\.?(?:\s|\#|$))
+''', re.VERBOSE)
+TURTLE_ESCAPE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))", re.DOTALL)
+TURTLE_ECHARS = {
+    "t": "\t", "b": "\b", "n": "\n", "r": "\r", "f": "\f",
+    '"': '"', "'": "'", "\\": "\\"}
+
+
+def to_minutes(dt):
+    # Literals with an offset are counted in UTC; EPOCH itself is naive.
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(minutes=1)
+
+
+def from_minutes(minutes, tz=None):
+    # tz is the offset the data was written in (Scheduler.time_zone); the
+    # result is shown in it again, or stays naive for naive data.
+    dt = EPOCH + timedelta(minutes=minutes)
+    if tz is not None:
+        dt = dt.replace(tzinfo=timezone.utc).astimezone(tz)
+    return dt
+
+
+def local_name(uri):
+    uri = str(uri)
+    if uri.startswith(EX_PREFIX):
+        return uri[len(EX_PREFIX):]
+    return uri.rpartition("/")[2]
+
+
+@functools.lru_cache(maxsize=None)
+def prepared_query(text):
+    # rdflib is imported here and in parse_turtle only: it costs ~0.1s to
+    # import (the SPARQL engine ~0.14s more) and is only needed when
+    # read_turtle cannot handle the data files.
+    from rdflib import Namespace
+    from rdflib.plugins.sparql import prepareQuery
+    return prepareQuery(text, initNs={"ex": Namespace(EX_PREFIX)})
+
+
+def parse_turtle(path):
+    from rdflib import Graph
+    return Graph().parse(path, format="turtle")
+
+
+def turtle_tokens(text):
+    pos = 0
+    while pos < len(text):
+        match = TURTLE_TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"unsupported Turtle syntax at offset {pos}")
+        if match["string"] is not None and text.startswith('"""', pos):
+            raise ValueError(f"long string literal at offset {pos}")
+        if match["name"] is not None and match["name"].startswith("'"):
+            raise ValueError(f"single-quoted literal at offset {pos}")
+        pos = match.end()
+        if match.lastgroup != "space":
+            yield match
+
+
+def turtle_unescape(value):
+    def replace(escape):
+        code = escape[1] or escape[2]
+        if code is not None:
+            return chr(int(code, 16))
+        if escape[3] not in TURTLE_ECHARS:
+            raise ValueError(f"invalid escape \\{escape[3]} in Turtle string")
+        return TURTLE_ECHARS[escape[3]]
+    return TURTLE_ESCAPE.sub(replace, value) if "\\" in value else value
+
+
+def turtle_term(token, prefixes):
+    if token["iri"] is not None:
+        return token["iri"]
+    if token["string"] is not None:
+        value = turtle_unescape(token["string"][1:-1])
+        if token["datatype"] is None:
+            return value
+        datatype = turtle_term(TURTLE_TOKEN.match(token["datatype"]), prefixes)
+        if datatype == XSD + "dateTime":
+            return datetime.fromisoformat(value)
+        if datatype in (XSD + "decimal", XSD + "double", XSD + "float"):
+            return float(value)
+        if datatype in (XSD + "integer", XSD + "int"):
+            return int(value)
+        return value
+    name = token["name"]
+    if name is None:
+        raise ValueError(f"unexpected {token.group()!r} in Turtle statement")
+    if name == "a":
+        return RDF_TYPE
+    if re.fullmatch(r"[+-]?\d+", name):
+        return int(name)
+    if re.fullmatch(r"[+-]?\d*\.\d+", name):
+        return float(name)
+    prefix, sep, local = name.partition(":")
+    if not sep or prefix not in prefixes:
+        raise ValueError(f"unknown prefixed name {name!r}")
+    return prefixes[prefix] + local
+
+
+def turtle_iri(token, prefixes):
+    term = turtle_term(token, prefixes)
+    if token["string"] is not None or not isinstance(term, str):
+        raise ValueError(f"expected an IRI, got {token.group()!r}")
+    return term
+
+
+def read_turtle(path):
+    """Reads the flat shape used under data/ into {subject: {predicate: [objects]}}.
+
+    Only prefixes, prefixed names, IRIs, numbers and (typed) double-quoted
+    string literals are understood. Anything else, such as blank nodes,
+    collections or long strings, and any malformed statement raises
+    ValueError so the caller can fall back to rdflib.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    prefixes = {}
+    subjects = defaultdict(lambda: defaultdict(list))
+    statement = []
+    for token in turtle_tokens(text):
+        if token["punct"] != ".":
+            statement.append(token)
+            continue
+        if not statement:
+            raise ValueError("empty Turtle statement")
+        if statement[0]["name"] == "@prefix":
+            if (len(statement) != 3 or statement[1]["name"] is None
+                    or not statement[1]["name"].endswith(":")):
+                raise ValueError("malformed @prefix directive")
+            prefixes[statement[1]["name"][:-1]] = turtle_term(statement[2], prefixes)
+            statement = []
+            continue
+        if len(statement) < 3:
+            raise ValueError("Turtle statement without a predicate and object")
+        properties = subjects[turtle_iri(statement[0], prefixes)]
+        i = 1
+        while i < len(statement):
+            objects = properties[turtle_iri(statement[i], prefixes)]
+            i += 1
+            while True:
+                if i >= len(statement) or statement[i]["punct"] is not None:
+                    raise ValueError("missing object in Turtle statement")
+                value = turtle_term(statement[i], prefixes)
+                if value not in objects:
+                    objects.append(value)
+                i += 1
+                if i < len(statement) and statement[i]["punct"] == ",":
+                    i += 1
+                    continue
+                break
+            if i < len(statement) and statement[i]["punct"] != ";":
+                raise ValueError("expected ';', ',' or '.' after Turtle object")
+            while i < len(statement) and statement[i]["punct"] == ";":
+                i += 1
+        statement = []
+    if statement:
+        raise ValueError("unterminated Turtle statement")
+    return subjects
+
+
+def source_stamp():
+    # The scheduler's own file is included so a change to the readers also
+    # invalidates the cached rows.
+    paths = (CLASSES_TTL, ROOMS_TTL, STUDENTS_TTL, __file__)
+    return tuple(os.stat(path).st_mtime_ns for path in paths)
 
 class Scheduler:
     def __init__(self):
-        self.EX = Namespace("http://example.org/")
-        self.SCHEMA = Namespace("http://schema.org/")
-        self.RDF = Namespace("http://www.w3.org/1999/02/22-rdf-syntax-ns#")
-
         self.classes = {}
         self.student_courses = {}
         self.min_room_caps_and_availability = {}
         self.time_slot_defs = {}
         self.course_to_students = {}
+        self.course_mask = {}
+        self.room_names = []
+        self.room_id = {}
+        self.time_zone = None
+        self.time_origin = 0
+        self.bin_minutes = GAP_MINUTES
+        self.options = {}
+        self.option_spans = {}
+        self.conflicting_courses = {}
+        self.room_busy = []
+        self.student_busy = {}
+        self.rooms_by_capacity = []
+        self.room_capacities = []
+        self.slot_windows = {}
 
     def load_data(self):
-        class_graph = Graph()
-        room_graph = Graph()
-        student_graph = Graph()
-
-        class_graph.parse("./data/classes.ttl", format="turtle")
-        room_graph.parse("./data/rooms.ttl", format="turtle")
-        student_graph.parse("./data/students.ttl", format="turtle")
-
-        for student in student_graph.subjects():
-            courses = []
-            for course in student_graph.objects(subject=student, predicate=URIRef(self.EX.enrolledIn)):
-                _, course_code = split_uri(course)
-                courses.append(course_code)
-            if courses:
-                _, student_name = split_uri(student)
-                student_name = student_name[1:]
-                self.student_courses[student_name] = courses
-
-        for c in class_graph.subjects():
-            _, class_code = split_uri(c)
-            min_room_cap = class_graph.value(
-                subject=c, predicate=URIRef(self.EX.hasMinimumRoomCapacity))
-            exam_duration = class_graph.value(
-                subject=c, predicate=URIRef(self.EX.examDuration))
-            self.classes[class_code] = (
-                int(min_room_cap.toPython()), float(exam_duration.toPython()))
-
-        for room, _, room_cap in room_graph.triples((None, URIRef(self.EX.roomCapacity), None)):
-            _, room_name = split_uri(room)
-            slot_uris = room_graph.objects(
-                room, URIRef(self.EX.hasAvailability))
-            available_slots = [split_uri(s)[1] for s in slot_uris]
-            self.min_room_caps_and_availability[room_name] = (
-                int(room_cap.toPython()), available_slots)
-
-        for subject in room_graph.subjects():
-            if str(subject).startswith(str(self.EX._Time_slot)):
-                _, slot = split_uri(subject)
-                start_lit = room_graph.value(
-                    subject=subject, predicate=URIRef(self.EX.availableFrom))
-                end_lit = room_graph.value(
-                    subject=subject, predicate=URIRef(self.EX.availableUntil))
-                start = start_lit.toPython()
-                end = end_lit.toPython()
-                slot_hours = (end - start).total_seconds() / 3600.0
-                self.time_slot_defs[slot] = (start, end, slot_hours)
+        enrollments, class_rows, room_rows, slot_rows = self.read_rows()
+
+        student_courses = defaultdict(list)
+        for student, course in enrollments:
+            student_courses[local_name(student)[1:]].append(local_name(course))
+        self.student_courses = dict(student_courses)
+
+        self.classes = {
+            local_name(c): (int(min_room_cap), float(exam_duration))
+            for c, min_room_cap, exam_duration in class_rows}
+
+        rooms = {}
+        for room, room_cap, slot_uri in room_rows:
+            room_name = local_name(room)
+            if room_name not in rooms:
+                rooms[room_name] = (int(room_cap), [])
+            if slot_uri is not None:
+                rooms[room_name][1].append(local_name(slot_uri))
+        self.min_room_caps_and_availability = rooms
+
+        # Times are compared in UTC, so mixed offsets would be exported in
+        # the wrong zone; all slots must share one offset (or none).
+        offsets = {dt.utcoffset() for _, start, end in slot_rows for dt in (start, end)}
+        if len(offsets) > 1:
+            raise ValueError("time slots do not all use the same UTC offset")
+        offset = next(iter(offsets), None)
+        self.time_zone = None if offset is None else timezone(offset)
+        time_slot_defs = {}
+        for subject, start_dt, end_dt in slot_rows:
+            start = to_minutes(start_dt)
+            end = to_minutes(end_dt)
+            slot_hours = (end - start) / 60.0
+            time_slot_defs[local_name(subject)] = (start, end, slot_hours)
+        self.time_slot_defs = time_slot_defs
+
+        course_to_students = defaultdict(set)
+        for student, enrolled_courses in self.student_courses.items():
+            for c in enrolled_courses:
+                course_to_students[c].add(student)
+        self.course_to_students = dict(course_to_students)
 
+        student_id = {name: i for i, name in enumerate(self.student_courses)}
+        self.course_mask = {c: 0 for c in self.classes}
         for student, enrolled_courses in self.student_courses.items():
+            bit = 1 << student_id[student]
             for c in enrolled_courses:
-                if c not in self.course_to_students:
-                    self.course_to_students[c] = set()
-                self.course_to_students[c].add(student)
-
-    def all_exam_windows(self, slot_start, slot_end, exam_duration, step_hours=0.166):
-        windows = []
-        current = slot_start
-        while current + timedelta(hours=exam_duration) <= slot_end:
-            windows.append((current, current + timedelta(hours=exam_duration)))
-            current += timedelta(hours=step_hours)
-        return windows
+                self.course_mask[c] = self.course_mask.get(c, 0) | bit
+        self.conflicting_courses = {
+            c: [other for other in self.classes
+                if other != c and self.course_mask[c] & self.course_mask[other]]
+            for c in self.classes}
+
+        self.room_names = list(self.min_room_caps_and_availability)
+        self.room_id = {name: i for i, name in enumerate(self.room_names)}
+        self.rooms_by_capacity = sorted(
+            (cap, self.room_id[room])
+            for room, (cap, _) in self.min_room_caps_and_availability.items())
+        self.room_capacities = [cap for cap, _ in self.rooms_by_capacity]
+        # Windows depend only on the slot and the exam length, not on the room
+        # or class, so they are enumerated once per (slot, duration) pair.
+        durations = {duration for _, duration in self.classes.values()}
+        self.slot_windows = {
+            (slot, duration): self.all_exam_windows(start, end, duration)
+            for slot, (start, end, _) in self.time_slot_defs.items()
+            for duration in durations}
+        self.options = {c: self.build_options(c) for c in self.classes}
+
+        # Time is cut into bins of the largest width that divides every window
+        # boundary and the gap, so a bitmask of bins captures overlap exactly.
+        self.time_origin = min((start for start, _, _ in self.time_slot_defs.values()), default=0)
+        self.bin_minutes = math.gcd(GAP_MINUTES, *(
+            t - self.time_origin
+            for options in self.options.values()
+            for option in options
+            for t in (option.start, option.end)))
+        self.option_spans = {
+            c: [self.time_span(option.start, option.end) for option in options]
+            for c, options in self.options.items()}
+
+    def read_rows(self):
+        # Only the parsed rows are cached: reading the TTL files is the slow
+        # step, and everything derived from the rows is rebuilt each time.
+        stamp = source_stamp()
+        rows = self.load_cache(stamp)
+        if rows is None:
+            try:
+                rows = self.read_turtle_rows()
+            except ValueError:
+                rows = self.read_rdflib_rows()
+            self.save_cache(stamp, rows)
+        return rows
+
+    def read_turtle_rows(self):
+        # Same rows as the SPARQL queries in read_rdflib_rows, straight from
+        # read_turtle. Raises ValueError if a file needs a full parser.
+        classes, rooms, students = (
+            read_turtle(path) for path in (CLASSES_TTL, ROOMS_TTL, STUDENTS_TTL))
+        enrollments = [
+            (student, course)
+            for student, props in students.items()
+            for course in props.get(P_ENROLLED, ())]
+        class_rows = [
+            (c, cap, duration)
+            for c, props in classes.items()
+            for cap in props.get(P_MIN_CAP, ())
+            for duration in props.get(P_DURATION, ())]
+        room_rows = [
+            (room, cap, slot)
+            for room, props in rooms.items()
+            for cap in props.get(P_ROOM_CAP, ())
+            for slot in props.get(P_HAS_AVAIL, [None])]
+        slot_rows = [
+            (slot, start, end)
+            for slot, props in rooms.items()
+            for start in props.get(P_FROM, ())
+            for end in props.get(P_UNTIL, ())]
+        return enrollments, class_rows, room_rows, slot_rows
+
+    def read_rdflib_rows(self):
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            class_graph, room_graph, student_graph = pool.map(
+                parse_turtle, (CLASSES_TTL, ROOMS_TTL, STUDENTS_TTL))
+
+        # IRIs become plain strings so the rows pickle without rdflib types.
+        enrollments = [
+            (str(student), str(course))
+            for student, course in student_graph.query(prepared_query(ENROLLMENT_QUERY))]
+        class_rows = [
+            (str(c), cap.toPython(), duration.toPython())
+            for c, cap, duration in class_graph.query(prepared_query(CLASS_QUERY))]
+        room_rows = [
+            (str(room), cap.toPython(), None if slot is None else str(slot))
+            for room, cap, slot in room_graph.query(prepared_query(ROOM_QUERY))]
+        slot_rows = [
+            (str(slot), start.toPython(), end.toPython())
+            for slot, start, end in room_graph.query(prepared_query(TIME_SLOT_QUERY))]
+        return enrollments, class_rows, room_rows, slot_rows
+
+    def load_cache(self, stamp):
+        try:
+            with open(CACHE_PATH, "rb") as f:
+                cached_stamp, rows = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if cached_stamp != stamp:
+            return None
+        return rows
+
+    def save_cache(self, stamp, rows):
+        tmp_path = CACHE_PATH + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((stamp, rows), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, CACHE_PATH)
+        except OSError:
+            pass
+
+    def all_exam_windows(self, slot_start, slot_end, exam_duration, step_minutes=10):
+        duration = round(exam_duration * 60)
+        return [(start, start + duration)
+                for start in range(slot_start, slot_end - duration + 1, step_minutes)]
+
+    def time_span(self, start, end):
+        # Bits for the bins covered by [start, end + gap); two exams clash
+        # exactly when their spans share a bit.
+        first = (start - self.time_origin) // self.bin_minutes
+        last = -(-(end + GAP_MINUTES - self.time_origin) // self.bin_minutes)
+        return ((1 << (last - first)) - 1) << first
 
     def is_consistent(self, course, option, assignment):
-        start_new, end_new = option['window']
-        room_new = option['room']
-        students_new = self.course_to_students.get(course, set())
-        gap = timedelta(minutes=10)
-
-        for other_course, other_val in assignment.items():
-            start_other, end_other = other_val['window']
-            
-            if start_new < (end_other + gap) and start_other < (end_new + gap):
-                if room_new == other_val['room']:
+        mask_new = self.course_mask[course]
+        gap = GAP_MINUTES
+
+        for other_course, other in assignment.items():
+            if option.start < (other.end + gap) and other.start < (option.end + gap):
+                if option.room == other.room:
                     return False
-                if students_new.intersection(self.course_to_students.get(other_course, set())):
+                if mask_new & self.course_mask[other_course]:
                     return False
         return True
 
     def get_options(self, course_code):
+        return self.options[course_code]
+
+    def build_options(self, course_code):
         options = []
         min_cap, duration = self.classes[course_code]
-        for room, (room_cap, available_slots) in self.min_room_caps_and_availability.items():
-            if room_cap < min_cap:
-                continue
+        first = bisect.bisect_left(self.room_capacities, min_cap)
+        # Rooms that seat the whole cohort come first, closest fit first, so a
+        # large room stays free for a cohort that needs it. Rooms that only
+        # meet the class's minimum capacity are kept as a last resort.
+        cohort = len(self.course_to_students.get(course_code, ()))
+        eligible = sorted(self.rooms_by_capacity[first:], key=lambda room: (
+            room[0] < cohort, abs(room[0] - cohort)))
+        for _, room_id in eligible:
+            _, available_slots = self.min_room_caps_and_availability[self.room_names[room_id]]
             for slot in available_slots:
-                s_start, s_end, _ = self.time_slot_defs[slot]
-                for window in self.all_exam_windows(s_start, s_end, duration):
-                    options.append({'room': room, 'window': window})
+                _, _, slot_hours = self.time_slot_defs[slot]
+                if slot_hours < duration:
+                    continue
+                for start, end in self.slot_windows[slot, duration]:
+                    options.append(Option(room_id, start, end))
         return options
 
+    def unschedulable_classes(self):
+        # Classes with no room big enough and free long enough; no search can
+        # place these, so callers report them instead of backtracking.
+        return [c for c in self.classes if not self.options[c]]
+
+    def ordered_classes(self):
+        # Fewest options first, larger cohorts first among equals; MRV in
+        # schedule_backtrack breaks ties in this order.
+        return sorted(self.classes, key=lambda c: (
+            len(self.options[c]), -len(self.course_to_students.get(c, ()))))
+
+    def book(self, course, option, span):
+        # room_busy[room] holds the spans booked in that room; student_busy[c]
+        # holds the spans of placed courses that share a student with c.
+        self.room_busy[option.room] |= span
+        saved = [(other, self.student_busy[other]) for other in self.conflicting_courses[course]]
+        for other, busy in saved:
+            self.student_busy[other] = busy | span
+        return saved
+
+    def unbook(self, option, span, saved):
+        self.room_busy[option.room] &= ~span
+        for other, busy in saved:
+            self.student_busy[other] = busy
+
+    def forward_check(self, unassigned, domains):
+        room_busy = self.room_busy
+        pruned = []
+        for other in unassigned:
+            other_options = self.options[other]
+            other_spans = self.option_spans[other]
+            student_busy = self.student_busy[other]
+            kept = [i for i in domains[other]
+                    if not (room_busy[other_options[i].room] | student_busy) & other_spans[i]]
+            if len(kept) != len(domains[other]):
+                pruned.append((other, domains[other]))
+                domains[other] = kept
+            if not kept:
+                self.restore_domains(domains, pruned)
+                return None
+        return pruned
+
+    def restore_domains(self, domains, pruned):
+        for other, previous in reversed(pruned):
+            domains[other] = previous
+
     def schedule_backtrack(self, assignment, classes_to_schedule):
-        if not classes_to_schedule:
-            return assignment
-        current_class = classes_to_schedule[0]
-        remaining_classes = classes_to_schedule[1:]
-        for option in self.get_options(current_class):
-            if self.is_consistent(current_class, option, assignment):
-                assignment[current_class] = option
-                result = self.schedule_backtrack(assignment, remaining_classes)
-                if result is not None:
-                    return result
-                del assignment[current_class]
-        return None
+        self.room_busy = [0] * len(self.room_names)
+        self.student_busy = {c: 0 for c in self.classes}
+        for course, option in assignment.items():
+            self.book(course, option, self.time_span(option.start, option.end))
+        domains = {
+            c: [i for i, option in enumerate(self.options[c])
+                if self.is_consistent(c, option, assignment)]
+            for c in classes_to_schedule}
+
+        # Explicit stack instead of recursion. Each frame is
+        # [course, its index in unassigned, iterator over its domain, placement];
+        # placement holds what is needed to undo the option currently tried.
+        unassigned = list(classes_to_schedule)
+        stack = []
+        descend = True
+        while True:
+            if descend:
+                if not unassigned:
+                    return assignment
+                course = min(unassigned, key=lambda c: len(domains[c]))
+                position = unassigned.index(course)
+                del unassigned[position]
+                frame = [course, position, iter(domains[course]), None]
+                stack.append(frame)
+            else:
+                if not stack:
+                    return None
+                frame = stack[-1]
+                course = frame[0]
+                option, span, saved, pruned = frame[3]
+                del assignment[course]
+                self.restore_domains(domains, pruned)
+                self.unbook(option, span, saved)
+
+            descend = False
+            options = self.options[course]
+            spans = self.option_spans[course]
+            for i in frame[2]:
+                option = options[i]
+                span = spans[i]
+                saved = self.book(course, option, span)
+                pruned = self.forward_check(unassigned, domains)
+                if pruned is not None:
+                    assignment[course] = option
+                    frame[3] = (option, span, saved, pruned)
+                    descend = True
+                    break
+                self.unbook(option, span, saved)
+            if not descend:
+                stack.pop()
+                unassigned.insert(frame[1], course)
 
 def run_and_export_json(scheduler):
     scheduler.load_data()
-    all_classes = list(scheduler.classes.keys())
+    unschedulable = scheduler.unschedulable_classes()
+    if unschedulable:
+        return json.dumps({
+            "error": "No room and availability window fits these exams",
+            "classes": unschedulable}, indent=4)
+    all_classes = scheduler.ordered_classes()
     final_schedule = scheduler.schedule_backtrack({}, all_classes)
 
     if final_schedule:
         structured_json = {}
         for i, (course_code, details) in enumerate(final_schedule.items(), 1):
             group_key = f"group_{i:04d}"
-            start_time, end_time = details['window']
-            time_slot_str = f"{start_time.isoformat()} - {end_time.isoformat()}"
-            student_list = [str(scheduler.EX[f"_{name}"]) for name in scheduler.course_to_students.get(course_code, [])]
+            room, start, end = details
+            tz = scheduler.time_zone
+            time_slot_str = f"{from_minutes(start, tz).isoformat()} - {from_minutes(end, tz).isoformat()}"
+            student_list = [EX_PREFIX + "_" + name for name in scheduler.course_to_students.get(course_code, [])]
             structured_json[group_key] = {
                 "students": student_list,
                 "room": {
-                    "room_iri": str(scheduler.EX[details['room']]),
+                    "room_iri": EX_PREFIX + scheduler.room_names[room],
                     "time_slot": time_slot_str
                 },
-                "class_iri": str(scheduler.EX[course_code])
+                "class_iri": EX_PREFIX + course_code
             }
         return json.dumps(structured_json, indent=4)
     else: